@@ -24,6 +24,8 @@ CREATE TABLE document_section (
 
     FOREIGN KEY (kind_id) REFERENCES document_section_kind(id)
 );
+-- Fragments are gathered up by the name of the code-section they belong to.
+CREATE INDEX document_section_name ON document_section (name);
 
 
 DROP TABLE IF EXISTS fragment_kind;
@@ -51,6 +53,9 @@ CREATE TABLE fragment (
     FOREIGN KEY (parent_id) REFERENCES document_section(id),
     FOREIGN KEY (parent_name_id) REFERENCES code_section_name(id)
 );
+-- Fragments are looked up by their parent, and then read in order for each code-section name.
+CREATE INDEX fragment_parent_id ON fragment (parent_id);
+CREATE INDEX fragment_parent_name_id ON fragment (parent_name_id, sequence);
 
 
 DROP TABLE IF EXISTS code_section_name;
@@ -62,14 +67,15 @@ CREATE TABLE code_section_name (
 
 DROP TABLE IF EXISTS non_root_code_section_name;
 CREATE TABLE non_root_code_section_name (
-    name_id INTEGER NOT NULL UNIQUE,
+    name_id INTEGER PRIMARY KEY NOT NULL,
 
     FOREIGN KEY (name_id) REFERENCES code_section_name(id)
-);
+) WITHOUT ROWID;
 
 
 DROP TABLE IF EXISTS resolved_code;
+-- Keyed on name_id itself rather than a separate unique index; but not WITHOUT ROWID, which suits only small rows.
 CREATE TABLE resolved_code (
-    name_id INTEGER NOT NULL UNIQUE,
+    name_id INTEGER PRIMARY KEY NOT NULL,
     code TEXT NOT NULL
 );
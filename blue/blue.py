@@ -1,10 +1,14 @@
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import functools
+import os
+from typing import Dict, Optional, Tuple
 
 import click
 
 from blue.errors import BlueScannerError
 from blue.code_writer import write_code_files
-from blue import scanner
+from blue import code_files_cache, scanner
 
 
 @click.group()
@@ -18,28 +22,96 @@ def blue(ctx, debug, verbose):
     # TO DO: set up logging here
 
 
+class _WorkerContext:
+    # Just enough of a click context for the scanner, which keeps its database connection in ctx.obj.
+    def __init__(self, obj):
+        self.obj = obj
+
+
+def read_code_files(ctx, file_path, roots_to_extract, database, use_cache) -> Dict[str, str]:
+    # Everything a cached entry holds is wanted; but only cache code files when they include every root.
+    key = code_files_cache.cache_key(file_path) if use_cache else None
+    code_files = code_files_cache.load(key) if key is not None else None
+    if code_files is None:
+        scanner.parse_source_file(ctx, database, file_path, roots_to_extract)
+        code_files = scanner.get_code_files(ctx)
+        if key is not None and roots_to_extract is None:
+            code_files_cache.store(key, code_files)
+    return code_files
+
+
+def _try_read_code_files(
+    ctx, roots_to_extract, database, use_cache, file_path
+) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
+    # Returns (code_files, None), or (None, the error message), so that errors can be reported in order by the process
+    # that asked for the file, even when the work was done elsewhere.
+    try:
+        return read_code_files(ctx, file_path, roots_to_extract, database, use_cache), None
+    except BlueScannerError as e:
+        return None, e.message
+
+
+def _try_read_code_files_in_worker(obj, roots_to_extract, use_cache, file_path):
+    return _try_read_code_files(_WorkerContext(obj), roots_to_extract, ":memory:", use_cache, file_path)
+
+
 @blue.command()
 @click.option("--extract-only", "-x", type=str, multiple=True)
 @click.option("--base-dir", type=click.Path(file_okay=False, dir_okay=True, writable=True, readable=True))
 @click.option("--database", type=str, default=":memory:")
+@click.option(
+    "--cache/--no-cache",
+    default=False,
+    help="Reuse code files tangled earlier from unchanged sources, kept in $XDG_CACHE_HOME/blue (~/.cache/blue by "
+    "default).  Nothing is ever evicted from there; delete it whenever you like.",
+)
+@click.option(
+    "--jobs", "-j", type=click.IntRange(min=1), help="How many files to tangle at once (default: one per CPU)."
+)
 @click.argument(
     "file_paths",
     type=click.Path(exists=True, file_okay=True, dir_okay=False, writable=False, readable=True),
     nargs=-1,
 )
 @click.pass_context
-def tangle(ctx, extract_only, file_paths, base_dir, database):
+def tangle(ctx, extract_only, file_paths, base_dir, database, cache, jobs):
     if ctx.obj["VERBOSE"]:
         message = "tangling with debug turned on" if ctx.obj["DEBUG"] else "tangling"
         click.echo(message)
     roots_to_extract = set(extract_only) or None
-    for file_path in file_paths:
-        try:
-            scanner.parse_source_file(ctx, database, Path(file_path))
-            code_files = scanner.get_code_files(ctx)
-            write_code_files(ctx, code_files, roots_to_extract, base_dir)
-        except BlueScannerError as e:
-            print(f'Error while processing "{file_path}": {e.message}')
+    # A cache hit skips the scanner entirely, so don't use the cache when the caller wants to keep the database.
+    use_cache = cache and database == ":memory:"
+    jobs = min(jobs or os.cpu_count() or 1, len(file_paths))
+    # Each source is scanned independently, so several can be scanned at once in separate processes; unless there is
+    # only one, or they must all go through the one database the caller asked for.  Either way, results come back in
+    # command-line order, however the scans finish.
+    error_messages = []
+    try:
+        with contextlib.ExitStack() as stack:
+            if jobs > 1 and database == ":memory:":
+                worker_obj = {"DEBUG": ctx.obj["DEBUG"], "VERBOSE": ctx.obj["VERBOSE"]}
+                read_one = functools.partial(_try_read_code_files_in_worker, worker_obj, roots_to_extract, use_cache)
+                results = stack.enter_context(ProcessPoolExecutor(max_workers=jobs)).map(read_one, file_paths)
+            else:
+                results = map(
+                    functools.partial(_try_read_code_files, ctx, roots_to_extract, database, use_cache), file_paths
+                )
+            # Only this process writes, in command-line order, so that when several sources produce the same output
+            # file the last one named wins.  Writing waits on the disk, so write one file's output on another thread
+            # while the next file is scanned; just one writer, to keep the order.
+            with ThreadPoolExecutor(max_workers=1) as writer:
+                writes = []
+                for code_files, error_message in results:
+                    error_messages.append(error_message)
+                    if code_files is not None:
+                        writes.append(writer.submit(write_code_files, ctx, code_files, roots_to_extract, base_dir))
+                for write in writes:
+                    write.result()  # raise anything that went wrong while writing, just as writing here would have
+    finally:
+        # Report the scanner errors even when a write fails, rather than losing them to the exception.
+        for file_path, error_message in zip(file_paths, error_messages):
+            if error_message is not None:
+                print(f'Error while processing "{file_path}": {error_message}')
 
 
 @blue.command()
@@ -58,7 +130,7 @@ def weave(ctx, file_paths, base_dir, database, output):
         click.echo(message)
     for file_path in file_paths:
         try:
-            scanner.parse_source_file(ctx, database, Path(file_path))
+            scanner.parse_source_file(ctx, database, file_path)
         except BlueScannerError as e:
             print(f'Error while processing "{file_path}": {e.message}')
 
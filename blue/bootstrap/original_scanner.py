@@ -1,18 +1,19 @@
+from bisect import bisect_right
 from collections import defaultdict
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+import os
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-from blue import errors, patterns
+from blue import common, errors, patterns
 
-
-@dataclass
-class CodeSectionReference:
-    name: str
-    indent: str
+# Fragments are tuples tagged with one of these kinds, so telling them apart is a single integer comparison:
+# (PLAIN_CODE, lines) or (CODE_SECTION_REFERENCE, name, indent).
+PLAIN_CODE = 0
+CODE_SECTION_REFERENCE = 1
 
 
-def coalesce_code_sections(root_source_file: Path) -> Dict[str, str]:
+def coalesce_code_sections(root_source_file: Union[str, os.PathLike]) -> Dict[str, str]:
     """
     For each unique code-section name in root_source_file and all its includes, build a hunk of text that is all the
     definitions of that name concatenated together in order.  Return a dictionary that maps each unique code-section
@@ -26,79 +27,87 @@ def coalesce_code_sections(root_source_file: Path) -> Dict[str, str]:
     @dataclass
     class CodeSectionInProgress:
         name: str
-        code: str
+        chunks: List[str]
 
         def __init__(self, name):
             self.name = name
-            self.code = ""
+            self.chunks = []
 
     code_section: Optional[CodeSectionInProgress] = None
-    code_sections: Dict[str, str] = defaultdict(str)
+    code_sections: Dict[str, List[str]] = defaultdict(list)
 
     def close_code_section():
         """
-        If we are collecting text from a code-section: stop collecting; and append it on to any previously collected
-        code of the same name.
+        If we are collecting text from a code-section: stop collecting; and append it on to the list of previously
+        collected definitions of the same name.  The definitions are joined together only once, after scanning.
 
         This function is called after every possible code-section terminal boundary.
         """
         nonlocal code_section
         if code_section is not None:
+            code = "".join(code_section.chunks)
             # code-sections are stored without a trailing newline
-            if code_section.code.endswith("\n"):
-                code_section.code = code_section.code[:-1]
-            # concatenated code-sections start on a new line
-            if code_section.name in code_sections:
-                code_sections[code_section.name] += "\n"
-            code_sections[code_section.name] += code_section.code
+            if code.endswith("\n"):
+                code = code[:-1]
+            code_sections[code_section.name].append(code)
             code_section = None
 
-    def scan_file(source_file: Path, path_stack: Optional[List[Path]] = None):
+    def scan_file(source_file: str, open_paths: Set[str]):
         """
-        Scan through one source file, looking for code-sections.  Maintain a stack of open files so we don't get caught
-        in a recursive loop.  Code-sections are terminated by: (1) a new code-section start; (2) a documentation-section
-        start; (3) an include statement; or (4) the end of the file.
+        Scan through one source file, looking for code-sections.  Maintain a set of open files (as plain strings,
+        resolved so that a path is recognized however it is spelled) so we don't get caught in a recursive loop.
+        Code-sections are terminated by: (1) a new code-section start; (2) a documentation-section start; (3) an include
+        statement; or (4) the end of the file.
 
         This function is called once per source-file.
         """
         nonlocal code_section
 
-        # manage the stack of open file paths
-        if path_stack is None:
-            path_stack = []
-        if source_file in path_stack:
+        # manage the set of open file paths
+        resolved_source_file = common.resolve_path(source_file)
+        if resolved_source_file in open_paths:
             raise errors.FileIncludeRecursionError(f'The file "{source_file}" recursively includes itself')
-        path_stack.append(source_file)
-
-        with open(source_file, "r") as f:
-            for line in f:
-                if match := patterns.CODE_BLOCK_START_PATTERN.match(line):
-                    close_code_section()
-                    new_code_section_name = match.group(1).strip()
-                    if not new_code_section_name:
-                        raise errors.BadSectionNameError(f"Section name must not be empty")
-                    if patterns.BAD_SECTION_NAME_PATTERN.search(new_code_section_name):
-                        raise errors.BadSectionNameError(
-                            f'Section name "{new_code_section_name}" may not contain "<<" or ">>"'
-                        )
-                    code_section = CodeSectionInProgress(new_code_section_name)
-                elif patterns.DOCUMENTATION_BLOCK_START_PATTERN.match(line):
-                    close_code_section()
-                elif match := patterns.INCLUDE_STATEMENT_PATTERN.match(line):
-                    close_code_section()
-                    relative_path = Path(match.group(1))
-                    current_working_directory = source_file.parent
-                    scan_file(current_working_directory / relative_path, path_stack)
-                elif code_section is not None:
-                    code_section.code += line
-            # eof also closes an open code-section
-            close_code_section()
-
-        # manage the stack of open file paths
-        path_stack.pop()
-
-    scan_file(root_source_file)
-    return code_sections
+        open_paths.add(resolved_source_file)
+
+        # read the whole file at once, and let the regex engine find the section boundaries within it; everything
+        # between two boundaries belongs to whatever the first one opened, and is collected as a single chunk
+        with open(source_file, "r", encoding="utf-8") as f:
+            text = f.read()
+        chunk_start = 0
+        for match in patterns.SECTION_BOUNDARY_PATTERN.finditer(text):
+            if code_section is not None and chunk_start < match.start():
+                code_section.chunks.append(text[chunk_start : match.start()])
+            chunk_start = match.end() + 1  # the boundary line's newline goes along with it
+            boundary = match.lastgroup
+            if boundary == "code_block_start":
+                close_code_section()
+                # section names are compared and hashed over and over, so intern them as they enter
+                new_code_section_name = sys.intern(match.group("code_block_start").strip())
+                if not new_code_section_name:
+                    raise errors.BadSectionNameError(f"Section name must not be empty")
+                if "<<" in new_code_section_name or ">>" in new_code_section_name:
+                    raise errors.BadSectionNameError(
+                        f'Section name "{new_code_section_name}" may not contain "<<" or ">>"'
+                    )
+                code_section = CodeSectionInProgress(new_code_section_name)
+            elif boundary == "documentation_block_start":
+                close_code_section()
+            elif boundary == "include_statement":
+                close_code_section()
+                relative_path = match.group("include_statement")
+                current_working_directory = os.path.dirname(source_file)
+                scan_file(os.path.join(current_working_directory, relative_path), open_paths)
+        if code_section is not None and chunk_start < len(text):
+            code_section.chunks.append(text[chunk_start:])
+        # eof also closes an open code-section
+        close_code_section()
+
+        # manage the set of open file paths
+        open_paths.remove(resolved_source_file)
+
+    scan_file(os.fspath(root_source_file), set())
+    # concatenated code-sections start on a new line
+    return {name: "\n".join(definitions) for name, definitions in code_sections.items()}
 
 
 def split_code_sections_into_fragment_lists(code_section_dict: Dict[str, str]) -> Tuple[Dict[str, List[Any]], Set[str]]:
@@ -109,106 +118,203 @@ def split_code_sections_into_fragment_lists(code_section_dict: Dict[str, str]) -
     pass.  So we do it in two steps.  This function is the first step, where we convert every named code-section into a
     corresponding named fragment-list: a dict->dict transformation.
 
-    A fragment-list is an ordered sequence of two different kinds of objects: (1) a plain hunks of code, represented by
-    str's; and (2) references to named code-sections, represented by a CodeSectionReference's.  The two types do not
-    necessarily alternate.  While we're looking for references, we're skipping over plain code.  Keep track of where
-    that plain code starts (the end of the last reference we collected) so we can turn that into a fragment in the list
-    when we stop to collect the next reference.
+    A fragment-list is an ordered sequence of two different kinds of tuples: (1) a plain hunks of code, tagged
+    PLAIN_CODE and represented by lists of lines (split just once, here, however many times they are referenced); and
+    (2) references to named code-sections, tagged CODE_SECTION_REFERENCE along with the name and indent.  The two kinds
+    do not necessarily alternate.  While we're looking for references, we're skipping over plain code.  Keep track of
+    where that plain code starts (the end of the last reference we collected) so we can turn that into a fragment in the
+    list when we stop to collect the next reference.
+
+    Rather than scanning each code-section for references separately, scan them all at once: a reference can't span a
+    line break, so joined by newlines the code-sections can't produce a reference that isn't in any one of them.  Each
+    match is handed back to the code-section it falls within.
 
     Since we see every code-section name and notice if it is ever included, we can also build a set of root names.  We
     return both the dictionary of named fragment-lists and the set of root names.
     """
+    code_section_starts = []
+    next_code_section_start = 0
+    for code_section in code_section_dict.values():
+        code_section_starts.append(next_code_section_start)
+        next_code_section_start += len(code_section) + 1  # + 1 for the joining newline
+    all_code_sections = "\n".join(code_section_dict.values())
+    matches_by_code_section: Dict[int, List[Any]] = defaultdict(list)
+    # only code containing "<<" can hold a reference, so don't bother running the regex over anything else
+    if "<<" in all_code_sections:
+        for match in patterns.CODE_BLOCK_REFERENCE_PATTERN.finditer(all_code_sections):
+            matches_by_code_section[bisect_right(code_section_starts, match.start()) - 1].append(match)
+
     fragment_dict = {}
-    all_section_names = set()
+    # a code-section is a root until it is referenced; references may come before or after the definition
+    roots = set()
     referenced_section_names = set()
-    for code_section_name, code_section in code_section_dict.items():
-        all_section_names.add(code_section_name)
+    for index, (code_section_name, code_section) in enumerate(code_section_dict.items()):
+        if code_section_name not in referenced_section_names:
+            roots.add(code_section_name)
         fragment_list: List[Any] = []
+        code_section_start = code_section_starts[index]
         plain_code_start = 0
-        for match in patterns.CODE_BLOCK_REFERENCE_PATTERN.finditer(code_section):
+        for match in matches_by_code_section.get(index, ()):
             reference_is_escaped = False
-            name = match.group("just_the_referenced_name").strip()
-            if patterns.BAD_SECTION_NAME_PATTERN.search(name):
+            name = sys.intern(match.group("just_the_referenced_name").strip())
+            if "<<" in name or ">>" in name:
                 raise errors.BadSectionNameError(f'Section name (reference) "{name}" may not contain "<<" or ">>"')
             indent = match.group("indent") or ""
-            plain_code = code_section[plain_code_start : match.start("complete_reference")]
+            reference_start = match.start("complete_reference") - code_section_start
+            plain_code = code_section[plain_code_start:reference_start]
             if plain_code.endswith("\\"):
                 reference_is_escaped = True
                 # chop off the escape character and collect the reference as plain code
                 plain_code = plain_code[:-1]
-                plain_code_start = match.start("complete_reference")
+                plain_code_start = reference_start
             else:
                 # else the next hunk of plain code starts immediately after the reference we are currently collecting
-                plain_code_start = match.end("complete_reference")
+                plain_code_start = match.end("complete_reference") - code_section_start
             if plain_code:
-                fragment_list.append(plain_code)
+                fragment_list.append((PLAIN_CODE, plain_code.splitlines(keepends=True)))
             if not reference_is_escaped:
-                fragment_list.append(CodeSectionReference(name, indent))
+                fragment_list.append((CODE_SECTION_REFERENCE, name, indent))
                 referenced_section_names.add(name)
+                roots.discard(name)
         # if there's any un-collected plain code at the end: collect it
         if plain_code_start < len(code_section):
-            fragment_list.append(code_section[plain_code_start:])
+            fragment_list.append((PLAIN_CODE, code_section[plain_code_start:].splitlines(keepends=True)))
         fragment_dict[code_section_name] = fragment_list
-    roots = all_section_names - referenced_section_names
     if not roots:
         raise errors.NoRootCodeSectionsFoundError("No root code-sections found")
     return fragment_dict, roots
 
 
+# One code-section part way through being expanded by _expand_code_section.  Defined here, once, rather than inside
+# _expand_code_section, where building the class afresh on every call would cost far more than the expansion itself.
+@dataclass
+class _ExpansionInProgress:
+    key: Tuple[str, bool]
+    fragments: Iterator[Any]
+    needs_indent: bool
+    pieces: List[Tuple[bool, str]] = field(default_factory=list)
+    reference_indent: str = ""  # the indent of the reference currently being expanded from within this one
+
+    def add_nested_pieces(self, nested_pieces: List[Tuple[bool, str]]):
+        if self.reference_indent:
+            nested_pieces = [
+                (starts_a_line, self.reference_indent + text if starts_a_line else text)
+                for starts_a_line, text in nested_pieces
+            ]
+        if nested_pieces:
+            self.pieces.extend(nested_pieces)
+            self.needs_indent = nested_pieces[-1][1].endswith("\n")
+
+
+def _expand_code_section(
+    name: str,
+    needs_indent: bool,
+    fragment_dict: Dict[str, List[Any]],
+    name_stack: List[str],
+    expansions: Dict[Tuple[str, bool], List[Tuple[bool, str]]],
+) -> List[Tuple[bool, str]]:
+    """
+    The body of coalesce_fragments.  Expand the named code-section as if it were referenced with no indent, into a list
+    of (starts_a_line, text) pieces, where the text already carries the indent of any nested references.  Any other
+    indent can be applied afterwards by putting it in front of every piece that starts a line.
+
+    Nothing about that expansion depends on who references the code-section except whether the text before the
+    reference ended a line (needs_indent); so each expansion is built just once, and kept in expansions, no matter how
+    many times the code-section is referenced.
+
+    References are followed with an explicit stack of expansions in progress rather than by recursion, so deeply nested
+    code-sections cost no Python call frames and can't hit the recursion limit.
+    """
+
+    def start_expansion(name_to_expand: str, needs_indent_on_entry: bool) -> Optional[List[Tuple[bool, str]]]:
+        """Return the finished expansion if there already is one; otherwise push a new expansion in progress."""
+        # manage the stack of open code-section names (and the set of them, for a quick membership test)
+        if name_to_expand in open_names:
+            raise errors.CodeSectionRecursionError(f'Code-section "{name_to_expand}" recursively includes itself')
+        key = (name_to_expand, needs_indent_on_entry)
+        if (expansion := expansions.get(key)) is not None:
+            return expansion
+        if name_to_expand not in fragment_dict:
+            raise errors.NoSuchCodeSectionError(f'Code-section "{name_to_expand}" not found')
+        name_stack.append(name_to_expand)
+        open_names.add(name_to_expand)
+        stack.append(_ExpansionInProgress(key, iter(fragment_dict[name_to_expand]), needs_indent_on_entry))
+        return None
+
+    open_names = set(name_stack)
+    stack: List[_ExpansionInProgress] = []
+    finished_expansion = start_expansion(name, needs_indent)
+    while stack:
+        current = stack[-1]
+        if finished_expansion is not None:
+            current.add_nested_pieces(finished_expansion)
+        finished_expansion = None
+        fragment = next(current.fragments, None)
+        if fragment is None:
+            stack.pop()
+            # manage the stack of open code-section names
+            open_names.remove(name_stack.pop())
+            expansions[current.key] = finished_expansion = current.pieces
+        elif fragment[0] == PLAIN_CODE:
+            lines = fragment[1]
+            for line in lines:
+                current.pieces.append((current.needs_indent, line))
+                current.needs_indent = True
+            current.needs_indent = lines[-1].endswith("\n")
+        elif fragment[0] == CODE_SECTION_REFERENCE:
+            _, referenced_name, current.reference_indent = fragment
+            finished_expansion = start_expansion(referenced_name, current.needs_indent)
+    return finished_expansion
+
+
 def coalesce_fragments(
     hunk_in_progress: str,
     name: str,
     fragment_dict: Dict[str, List[Any]],
     name_stack: Optional[List[str]] = None,
     indent: str = "",
+    expansions: Optional[Dict[Tuple[str, bool], List[Tuple[bool, str]]]] = None,
 ) -> str:
     """
     Recursively step through a list of text fragments and references to other named lists of fragments and assemble them
     into contiguous hunks of text, being careful to preserve correct indentation.  Return that contiguous hunk of text.
     Maintain a stack of open section-names as we are referencing them to prevent getting caught in a recursive loop.
+    Pass the same expansions dictionary to every call that works from the same fragment_dict so they can share the
+    code-sections already expanded.
 
-    This function is called once for each root code-section definition, and once for each reference to a named code-
-    section.
+    This function is called once for each root code-section definition; references to named code-sections are followed
+    by _expand_code_section.
     """
-    # manage the stack of open code-section names
     if name_stack is None:
         name_stack = []
-    if name in name_stack:
-        raise errors.CodeSectionRecursionError(f'Code-section "{name}" recursively includes itself')
-    name_stack.append(name)
-
-    if name not in fragment_dict:
-        raise errors.NoSuchCodeSectionError(f'Code-section "{name}" not found')
-    for fragment in fragment_dict[name]:
-        if isinstance(fragment, str):
-            needs_indent = hunk_in_progress.endswith("\n")
-            for line in fragment.splitlines(keepends=True):
-                if needs_indent:
-                    hunk_in_progress += indent
-                hunk_in_progress += line
-                needs_indent = True
-        elif isinstance(fragment, CodeSectionReference):
-            hunk_in_progress = coalesce_fragments(
-                hunk_in_progress, fragment.name, fragment_dict, name_stack, indent + fragment.indent
-            )
-
-    # manage the stack of open code-section names
-    name_stack.pop()
-
-    return hunk_in_progress
-
-
-def get_code_files(ctx, root_source_file: Path) -> Dict[str, str]:
+    if expansions is None:
+        expansions = {}
+    expansion = _expand_code_section(name, hunk_in_progress.endswith("\n"), fragment_dict, name_stack, expansions)
+    pieces = [hunk_in_progress]
+    for starts_a_line, text in expansion:
+        if starts_a_line and indent:
+            pieces.append(indent)
+        pieces.append(text)
+    return "".join(pieces)
+
+
+def get_code_files(
+    ctx, root_source_file: Union[str, os.PathLike], roots_to_extract: Optional[Set[str]] = None
+) -> Dict[str, str]:
     """
     Pull together all the steps provided above to create complete hunks of text corresponding to output files.  Could
-    have replaced the last four lines with a dictionary comprehension, but this is clearer.
+    have replaced the loop with a dictionary comprehension, but this is clearer.  If roots_to_extract names some roots,
+    only those are expanded; there's no point expanding output files nobody is going to write.
 
     This function is called once per top-level source file.
     """
     code_sections: Dict[str, str] = coalesce_code_sections(root_source_file)
     fragment_lists, roots = split_code_sections_into_fragment_lists(code_sections)
     output_files: Dict[str, str] = {}
+    expansions: Dict[Tuple[str, bool], List[Tuple[bool, str]]] = {}
     for root in roots:
-        # an output file should end with exactly one newline
-        output_files[root] = coalesce_fragments("", root, fragment_lists).rstrip("\r\n") + "\n"
+        if roots_to_extract is not None and root not in roots_to_extract:
+            continue
+        expansion = _expand_code_section(root, False, fragment_lists, [], expansions)
+        output_files[root] = common.join_into_output_file([text for _, text in expansion])
     return output_files
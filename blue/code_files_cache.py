@@ -0,0 +1,94 @@
+"""
+A persistent cache of the code files tangled from literate source files, so that tangling a file that hasn't changed
+since the last time can skip scanning it altogether.
+
+An entry is keyed by a hash of the source file, the text of every file it (transitively) includes, and blue's own
+source code; so editing any of those files, or changing blue in any way, simply misses the old entry.  Entries are JSON
+files in $XDG_CACHE_HOME/blue (~/.cache/blue by default).  Nothing ever evicts them: an entry nobody can hit any more
+just sits there, so the directory grows until someone deletes it, which is always safe.
+"""
+
+import functools
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from blue import patterns
+
+
+@functools.lru_cache(maxsize=None)
+def _blue_source_digest() -> bytes:
+    """
+    Hash the code that decides what gets tangled, rather than trusting a version number: a checkout has none, and an
+    editable install keeps the same one through any number of fixes.  Hashing every module is simpler, and safer, than
+    keeping a list of the ones that matter.
+    """
+    package_directory = Path(__file__).parent
+    digest = hashlib.sha256()
+    for path in sorted(package_directory.rglob("*")):
+        if path.suffix in (".py", ".sql"):
+            name = path.relative_to(package_directory).as_posix().encode()
+            data = path.read_bytes()
+            for chunk in (name, data):
+                digest.update(len(chunk).to_bytes(8, "little"))
+                digest.update(chunk)
+    return digest.digest()
+
+
+def get_cache_directory() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "blue"
+
+
+def cache_key(source_file: str) -> Optional[str]:
+    """
+    Hash the source file and everything it includes, following includes just as the scanner does.  If any of those
+    files can't be read, there is nothing trustworthy to key on, so return None; the scanner will report the problem.
+    """
+    digest = hashlib.sha256(_blue_source_digest())
+
+    def hash_file(path: str, seen_paths: Set[str]):
+        resolved_path = os.path.realpath(path)
+        if resolved_path in seen_paths:
+            return  # a recursive include; the scanner raises FileIncludeRecursionError for it
+        seen_paths.add(resolved_path)
+        # Hash the bytes just as they are on disk; decode them (exactly as the scanner's open() would) only to find
+        # the includes.
+        with open(path, "rb") as f:
+            data = f.read()
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+        text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8").read()
+        for match in patterns.SECTION_BOUNDARY_PATTERN.finditer(text):
+            if match.lastgroup == "include_statement":
+                hash_file(os.path.join(os.path.dirname(path), match.group("include_statement")), seen_paths)
+
+    try:
+        hash_file(os.fspath(source_file), set())
+    except (OSError, UnicodeError):
+        return None
+    return digest.hexdigest()
+
+
+def load(key: str) -> Optional[Dict[str, str]]:
+    try:
+        with open(get_cache_directory() / f"{key}.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store(key: str, code_files: Dict[str, str]):
+    # A cache that can't be written to just means the next tangle scans again; it isn't worth failing this one for.
+    cache_directory = get_cache_directory()
+    try:
+        cache_directory.mkdir(parents=True, exist_ok=True)
+        # Write under a temporary name and rename, so a concurrent load never sees a partial entry.
+        temporary_path = cache_directory / f"{key}.json.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(code_files, f)
+        os.replace(temporary_path, cache_directory / f"{key}.json")
+    except OSError:
+        pass
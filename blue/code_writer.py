@@ -1,14 +1,65 @@
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+
+
+def _is_already_written(path, data):
+    # Compare bytes, so a file only matches if writing it again would change nothing.
+    try:
+        with open(path, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def _write_code_file(path, code):
+    # Exactly what a text-mode write would put on disk, newline translation and all.  Sources are read as UTF-8, so
+    # write what was tangled from them the same way, whatever the locale.
+    data = code.replace("\n", os.linesep).encode("utf-8")
+    # Leave an unchanged file alone, so its modification time doesn't tell make et al. that it needs rebuilding.
+    if _is_already_written(path, data):
+        return
+    # Replace the file a symlinked output points at, not the link itself.
+    target_path = os.path.realpath(path)
+    owning_directory = os.path.dirname(target_path)
+    if not os.path.exists(owning_directory):
+        os.makedirs(owning_directory, exist_ok=True)  # exist_ok, because another writer may be making it too
+    try:
+        link_count = os.stat(target_path).st_nlink
+    except FileNotFoundError:
+        link_count = 0
+    if link_count > 1:
+        # A rename would split a hard-linked file from its other names; only writing in place updates them all.
+        with open(target_path, "wb") as f:
+            f.write(data)
+        return
+    # Write under a temporary name and rename, so that a crash or a concurrent reader never sees half a file.  The
+    # rename replaces the file rather than rewriting it, so carry over its mode (it might be an executable script).
+    temporary_path = f"{target_path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        if link_count:
+            shutil.copymode(target_path, temporary_path)
+        os.replace(temporary_path, target_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
 
 
 def write_code_files(ctx, code_files, roots_to_extract=None, base_directory=None):
-    base_directory = Path(".") if base_directory is None else Path(base_directory)
+    base_directory = "." if base_directory is None else os.fspath(base_directory)
+    paths, codes = [], []
     for file_name, code in code_files.items():
         if roots_to_extract is not None and file_name not in roots_to_extract:
             continue
-        path = base_directory / file_name
-        owning_directory = path.parent
-        if not owning_directory.exists():
-            owning_directory.mkdir(parents=True)
-        with open(path, "w") as f:
-            f.write(code)
+        paths.append(os.path.join(base_directory, file_name))
+        codes.append(code)
+    if len(paths) < 2:
+        for path, code in zip(paths, codes):
+            _write_code_file(path, code)
+        return
+    # Writing is mostly waiting on the file system, so write the files at once, each on its own thread.
+    with ThreadPoolExecutor(max_workers=min(32, len(paths))) as executor:
+        list(executor.map(_write_code_file, paths, codes))  # list() to raise anything that went wrong
@@ -0,0 +1,26 @@
+import os
+from typing import Dict, List
+
+# Resolving a path means a system call for each of its components, and the same includes are resolved over and over;
+# so remember each path's resolution for the life of the process.
+_RESOLVED_PATHS: Dict[str, str] = {}
+
+
+def resolve_path(path: str) -> str:
+    absolute_path = os.path.abspath(path)  # Cheap, and stays right even if the cwd changes.
+    if (resolved_path := _RESOLVED_PATHS.get(absolute_path)) is None:
+        resolved_path = _RESOLVED_PATHS[absolute_path] = os.path.realpath(absolute_path)
+    return resolved_path
+
+
+def join_into_output_file(pieces: List[str]) -> str:
+    """
+    An output file should end with exactly one newline.  Trim the pieces rather than the joined text, so that the
+    (possibly large) joined text is only built once.
+    """
+    while pieces and not pieces[-1].rstrip("\r\n"):
+        pieces.pop()
+    if pieces:
+        pieces[-1] = pieces[-1].rstrip("\r\n")
+    pieces.append("\n")
+    return "".join(pieces)
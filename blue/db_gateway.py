@@ -1,5 +1,7 @@
 from contextlib import contextmanager
-from typing import Generator, Optional
+import functools
+import os
+from typing import Dict, Generator, Iterable, Optional, Tuple
 
 import sqlite3
 
@@ -11,6 +13,47 @@ def open_cursor(db: sqlite3.Connection) -> Generator:
     cursor.close()
 
 
+@contextmanager
+def transaction(db: sqlite3.Connection) -> Generator:
+    # The connection is opened in autocommit mode, so batches of writes must ask for a transaction explicitly.  Inside
+    # a transaction that is already open, just take part in it; the outermost one commits or rolls back.  Every
+    # transaction here writes, so take the write lock up front rather than failing to upgrade to it part way through.
+    if db.in_transaction:
+        yield db
+        return
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        # Some errors make SQLite roll back by itself; a second ROLLBACK would fail and hide the error that matters.
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+@functools.lru_cache(maxsize=None)
+def _schema_script() -> str:
+    # Every database gets the same schema, so read it just once; and find it next to this module, not the cwd.
+    with open(os.path.join(os.path.dirname(__file__), "blue-schema.sql")) as f:
+        return f.read()
+
+
+# Blank in-memory databases with the schema already built, to be copied rather than built again each time; one per
+# process, since SQLite connections must not be used across fork().  A template inherited from a parent process is left
+# alone rather than closed, for the same reason.
+_TEMPLATE_DATABASES: Dict[int, sqlite3.Connection] = {}
+
+
+def _template_database() -> sqlite3.Connection:
+    process_id = os.getpid()
+    if (template := _TEMPLATE_DATABASES.get(process_id)) is None:
+        template = sqlite3.connect(":memory:", check_same_thread=False)
+        template.executescript(_schema_script())
+        _TEMPLATE_DATABASES[process_id] = template
+    return template
+
+
 def get_database_connection(ctx):
     return ctx.obj.get("DATABASE_CONNECTION", None)
 
@@ -23,28 +66,34 @@ def create_database(ctx, db_path: str) -> sqlite3.Connection:
     db = sqlite3.connect(db_path, isolation_level=None)
     db.row_factory = sqlite3.Row
     set_database_connection(ctx, db)
-    with open("blue/blue-schema.sql") as f:
-        sql_script = f.read()
-    db.executescript(sql_script)
+    if db_path == ":memory:":
+        # A scratch database: there is nothing to make durable, and no other connection can ever see it.  (Its
+        # journal stays, though; transaction() relies on ROLLBACK.)
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("PRAGMA locking_mode = EXCLUSIVE")
+        db.execute("PRAGMA temp_store = MEMORY")
+        # Copying the template's pages is much cheaper than running the schema script; but foreign-key enforcement
+        # belongs to the connection, not the database, so it has to be turned on again here.
+        _template_database().backup(db)
+        db.execute("PRAGMA foreign_keys = ON")
+    else:
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.executescript(_schema_script())
     return db
 
 
-def insert_document_section(
-    db: sqlite3.Connection,
-    kind: str,
-    data: str,
-    is_included: bool,
-    name: Optional[str] = None,
-    sequence: Optional[float] = None,
+def insert_document_sections(
+    db: sqlite3.Connection, document_sections: Iterable[Tuple[str, bool, Optional[str], str, float]]
 ):
+    # Each document section is (kind, is_included, name, data, sequence).
     sql = """
         INSERT INTO document_section (kind_id, is_included, name, data, sequence) VALUES (
-            (SELECT id FROM document_section_kind WHERE description = :kind),
-            :_is_included, :name, :data, :sequence
+            (SELECT id FROM document_section_kind WHERE description = ?),
+            ?, ?, ?, ?
         )
     """
-    _is_included = int(is_included)
-    db.execute(sql, locals())
+    db.executemany(sql, document_sections)
 
 
 def raw_document_sections_in_order(db: sqlite3.Connection) -> Generator:
@@ -83,18 +132,20 @@ def code_section_ids_in_order(db: sqlite3.Connection) -> Generator:
         yield row["id"]
 
 
-def assign_code_section_presentation_number(db: sqlite3.Connection, code_section_id: int, presentation_number: int):
+def assign_code_section_presentation_numbers(
+    db: sqlite3.Connection, presentation_numbers_and_code_section_ids: Iterable[Tuple[int, int]]
+):
     sql = """
-        UPDATE document_section SET code_section_presentation_number = :presentation_number WHERE id = :code_section_id
+        UPDATE document_section SET code_section_presentation_number = ? WHERE id = ?
     """
-    db.execute(sql, locals())
+    db.executemany(sql, presentation_numbers_and_code_section_ids)
 
 
-def assign_code_section_name(db: sqlite3.Connection, code_section_id: int, name: str):
+def assign_code_section_names(db: sqlite3.Connection, names_and_code_section_ids: Iterable[Tuple[str, int]]):
     sql = """
-        UPDATE document_section SET name = :name WHERE id = :code_section_id
+        UPDATE document_section SET name = ? WHERE id = ?
     """
-    db.execute(sql, locals())
+    db.executemany(sql, names_and_code_section_ids)
 
 
 def resolved_code(db: sqlite3.Connection) -> Generator:
@@ -107,35 +158,42 @@ def resolved_code(db: sqlite3.Connection) -> Generator:
         yield row
 
 
-def insert_resolved_code(db: sqlite3.Connection, code_section_name_id: int, code: str):
+def resolved_code_for_name(db: sqlite3.Connection, name: str) -> Optional[str]:
     sql = """
-        INSERT OR IGNORE INTO resolved_code (name_id, code) VALUES (:code_section_name_id, :code)
+        SELECT code
+        FROM resolved_code
+        JOIN code_section_name ON id = name_id
+        -- The (case-insensitive) index finds the name; then insist on the exact name, as get_code_files's dict does.
+        WHERE name = :name
+            AND name = :name COLLATE BINARY
     """
-    db.execute(sql, locals())
+    row = db.execute(sql, locals()).fetchone()
+    return row["code"] if row is not None else None
 
 
-def assign_reference_fragment_name(db: sqlite3.Connection, fragment_id: int, name: str):
+def insert_resolved_code(db: sqlite3.Connection, resolved_code_by_name_id: Iterable[Tuple[int, str]]):
     sql = """
-        UPDATE fragment SET data = :name WHERE id = :fragment_id
+        INSERT OR IGNORE INTO resolved_code (name_id, code) VALUES (?, ?)
     """
-    db.execute(sql, locals())
+    db.executemany(sql, resolved_code_by_name_id)
 
 
-def insert_fragment(
-    db: sqlite3.Connection,
-    kind: str,
-    parent_id: int,
-    data: str,
-    indent: str = "",
-    sequence: Optional[float] = None,
-):
+def assign_reference_fragment_names(db: sqlite3.Connection, names_and_fragment_ids: Iterable[Tuple[str, int]]):
+    sql = """
+        UPDATE fragment SET data = ? WHERE id = ?
+    """
+    db.executemany(sql, names_and_fragment_ids)
+
+
+def insert_fragments(db: sqlite3.Connection, fragments: Iterable[Tuple[str, int, str, str, float]]):
+    # Each fragment is (kind, parent_id, data, indent, sequence).
     sql = """
         INSERT INTO fragment (kind_id, parent_id, data, indent, sequence) VALUES (
-            (SELECT id FROM fragment_kind WHERE description = :kind),
-            :parent_id, :data, :indent, :sequence
+            (SELECT id FROM fragment_kind WHERE description = ?),
+            ?, ?, ?, ?
         )
     """
-    db.execute(sql, locals())
+    db.executemany(sql, fragments)
 
 
 def collect_all_unabbreviated_names(db: sqlite3.Connection):
@@ -210,14 +268,14 @@ def resolve_abbreviation(db: sqlite3.Connection, abbreviation: str) -> Generator
         yield row["name"]
 
 
-def assign_fragment_parent_name_ids(db: sqlite3.Connection, code_section_name_id: int, code_section_name: str):
+def assign_fragment_parent_name_ids(db: sqlite3.Connection, code_section_name_ids_and_names: Iterable[Tuple[int, str]]):
     sql = """
-        UPDATE fragment SET parent_name_id = :code_section_name_id
+        UPDATE fragment SET parent_name_id = ?
         WHERE parent_id IN (
-            SELECT id FROM document_section WHERE name = :code_section_name
+            SELECT id FROM document_section WHERE name = ?
         )
     """
-    db.execute(sql, locals())
+    db.executemany(sql, code_section_name_ids_and_names)
 
 
 def fragments_belonging_to_this_name_in_order(db: sqlite3.Connection, code_section_name: str) -> Generator:
@@ -1,20 +1,29 @@
 import re
 
 
-DOCUMENTATION_BLOCK_START_PATTERN = re.compile(r"^@$")
-
-CODE_BLOCK_START_PATTERN = re.compile(r"^<<(.*)>>=$")
+# Search a whole file with this to find just the lines that end one section and begin another.
+SECTION_BOUNDARY_PATTERN = re.compile(
+    r"""
+    ^(?:
+        <<(?P<code_block_start>.*)>>=           # the name of the new code-section
+        | (?P<documentation_block_start>@)
+        | @include\((?P<include_statement>.*)\)  # the path of the included file
+    )$
+    """,
+    re.VERBOSE + re.MULTILINE,
+)
 
 CODE_BLOCK_REFERENCE_PATTERN = re.compile(
     r"""
     (?P<indent>^[ \t]+)?
     (?P<complete_reference>                    # to throw away the delimiters we need to know where they are
-        <<(?P<just_the_referenced_name>.*?)>>  # there may be more than one reference on the line, so be non-greedy
+        <<(?P<just_the_referenced_name>        # there may be more than one reference on the line, so stop at the first
+            (?:[^>\n]|>(?!>))*                 # ">>"; a character class does that without a lazy quantifier's retries
+        )>>
     )
     """,
     re.VERBOSE + re.MULTILINE,
 )
 
-INCLUDE_STATEMENT_PATTERN = re.compile(r"^@include\((.*)\)$")
-
-BAD_SECTION_NAME_PATTERN = re.compile(r"<<|>>")
+# str.splitlines breaks lines at all of these, as well as at "\n".
+LINE_BOUNDARY_OTHER_THAN_NEWLINE_PATTERN = re.compile("[\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
@@ -19,97 +19,133 @@ are code or documentation, you can tell what's in the fragment.  A fragment that
 the name (via an id) of that code.
 """
 
-from dataclasses import dataclass
-from pathlib import Path
-from typing import List, Optional, Union
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import os
+import re
+from typing import List, Optional, Set, Tuple, Union
 
 import sqlite3
 
-from blue import db_gateway, errors, patterns
-
-
-def split_source_document_into_sections(ctx, source_document: Path):
+from blue import common, db_gateway, errors, patterns
+
+# Files already read (and searched for section boundaries) by this process, most recently used last.  Keyed by the
+# resolved path, and only trusted while the modification time and size still match, so a file included by several
+# sources is read once, but an edited file is read again (and replaces what was remembered of it).  Only the most
+# recently used files are kept, so a long-lived process doesn't hold on to every file it has ever scanned.
+_SCANNED_FILES: "OrderedDict[str, Tuple[Tuple[int, int], Tuple[str, List[re.Match]]]]" = OrderedDict()
+_SCANNED_FILES_LIMIT = 256
+
+
+def _read_and_find_section_boundaries(path: str, resolved_path: str) -> Tuple[str, List[re.Match]]:
+    status = os.stat(path)
+    version = (status.st_mtime_ns, status.st_size)
+    entry = _SCANNED_FILES.get(resolved_path)
+    if entry is not None and entry[0] == version:
+        _SCANNED_FILES.move_to_end(resolved_path)
+        return entry[1]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    scanned_file = (text, list(patterns.SECTION_BOUNDARY_PATTERN.finditer(text)))
+    _SCANNED_FILES[resolved_path] = (version, scanned_file)
+    _SCANNED_FILES.move_to_end(resolved_path)
+    while len(_SCANNED_FILES) > _SCANNED_FILES_LIMIT:
+        _SCANNED_FILES.popitem(last=False)
+    return scanned_file
+
+
+def split_source_document_into_sections(db: sqlite3.Connection, source_document: Union[str, os.PathLike]):
     @dataclass()
     class DocumentationSectionInProgress:
-        data: str = ""
+        chunks: List[str] = field(default_factory=list)
 
         def close(self, is_included):
             nonlocal sequence
-            if self.data:
-                db_gateway.insert_document_section(db, "documentation", self.data, is_included, sequence=sequence)
+            if data := "".join(self.chunks):
+                document_sections.append(("documentation", is_included, None, data, sequence))
                 sequence += 1.0
 
     @dataclass()
     class CodeSectionInProgress:
         name: str
-        data: str = ""
+        chunks: List[str] = field(default_factory=list)
 
         def close(self, is_included):
             nonlocal sequence
-            if self.data.endswith("\n"):
-                self.data = self.data[:-1]
-            db_gateway.insert_document_section(db, "code", self.data, is_included, self.name, sequence=sequence)
+            data = "".join(self.chunks)
+            if data.endswith("\n"):
+                data = data[:-1]
+            document_sections.append(("code", is_included, self.name, data, sequence))
             sequence += 1.0
 
-    def scan_file(path: Path, path_stack: Optional[List[Path]] = None):
-        # Manage the stack of open files.
-        is_included = path_stack is not None
-        if path_stack is None:
-            path_stack = []
-        if path in path_stack:
+    def scan_file(path: str, open_paths: Set[str], is_included: bool):
+        # Manage the set of open files.  Paths are plain strings, compared once resolved, however they were spelled.
+        resolved_path = common.resolve_path(path)
+        if resolved_path in open_paths:
             raise errors.FileIncludeRecursionError(f'The file "{path}" recursively includes itself.')
-        path_stack.append(path)
-
-        with open(path, "r") as f:
-            current_section: Union[
-                DocumentationSectionInProgress, CodeSectionInProgress
-            ] = DocumentationSectionInProgress()
-            for line in f:
-                if match := patterns.CODE_BLOCK_START_PATTERN.match(line):
-                    current_section.close(is_included)
-                    new_code_section_name = match.group(1).strip()
-                    if not new_code_section_name:
-                        raise errors.BadSectionNameError(f"Code-section name must not be empty.")
-                    if patterns.BAD_SECTION_NAME_PATTERN.search(new_code_section_name):
-                        raise errors.BadSectionNameError(
-                            f'Code-section name "{new_code_section_name}" must not contain "<<" or ">>".'
-                        )
-                    current_section = CodeSectionInProgress(new_code_section_name)
-                elif patterns.DOCUMENTATION_BLOCK_START_PATTERN.match(line):
-                    current_section.close(is_included)
-                    current_section = DocumentationSectionInProgress()
-                elif match := patterns.INCLUDE_STATEMENT_PATTERN.match(line):
-                    current_section.close(is_included)
-                    relative_path = Path(match.group(1))
-                    current_working_directory = path.parent
-                    scan_file(current_working_directory / relative_path, path_stack)
-                    current_section = DocumentationSectionInProgress()
-                else:
-                    current_section.data += line
-            current_section.close(is_included)
-
-        # Manage the stack of open files.
-        path_stack.pop()
-
-    db = db_gateway.get_database_connection(ctx)
+        open_paths.add(resolved_path)
+
+        # Read the whole file at once, and let the regex engine find the section boundaries within it.  Everything
+        # between two boundaries belongs to the section the first one opened, and is collected as a single chunk.
+        text, boundaries = _read_and_find_section_boundaries(path, resolved_path)
+        current_section: Union[DocumentationSectionInProgress, CodeSectionInProgress] = DocumentationSectionInProgress()
+        chunk_start = 0
+        for match in boundaries:
+            if chunk_start < match.start():
+                current_section.chunks.append(text[chunk_start : match.start()])
+            chunk_start = match.end() + 1  # the boundary line's newline goes along with it
+            boundary = match.lastgroup
+            if boundary == "code_block_start":
+                current_section.close(is_included)
+                new_code_section_name = match.group("code_block_start").strip()
+                if not new_code_section_name:
+                    raise errors.BadSectionNameError(f"Code-section name must not be empty.")
+                if "<<" in new_code_section_name or ">>" in new_code_section_name:
+                    raise errors.BadSectionNameError(
+                        f'Code-section name "{new_code_section_name}" must not contain "<<" or ">>".'
+                    )
+                current_section = CodeSectionInProgress(new_code_section_name)
+            elif boundary == "documentation_block_start":
+                current_section.close(is_included)
+                current_section = DocumentationSectionInProgress()
+            elif boundary == "include_statement":
+                current_section.close(is_included)
+                relative_path = match.group("include_statement")
+                current_working_directory = os.path.dirname(path)
+                scan_file(os.path.join(current_working_directory, relative_path), open_paths, True)
+                current_section = DocumentationSectionInProgress()
+        if chunk_start < len(text):
+            current_section.chunks.append(text[chunk_start:])
+        current_section.close(is_included)
+
+        # Manage the set of open files.
+        open_paths.remove(resolved_path)
+
+    # Collect every document-section, and then insert them all in one go.
+    document_sections: List[Tuple[str, bool, Optional[str], str, float]] = []
     sequence = 0.0
-    scan_file(source_document)
+    scan_file(os.fspath(source_document), set(), False)
+    with db_gateway.transaction(db):
+        db_gateway.insert_document_sections(db, document_sections)
 
 
-def assign_presentation_numbers_to_code_sections(ctx):
-    db = db_gateway.get_database_connection(ctx)
-    for presentation_number, code_section_id in enumerate(db_gateway.code_section_ids_in_order(db), 1):
-        db_gateway.assign_code_section_presentation_number(db, code_section_id, presentation_number)
+def assign_presentation_numbers_to_code_sections(db: sqlite3.Connection):
+    numbering = list(enumerate(db_gateway.code_section_ids_in_order(db), 1))
+    with db_gateway.transaction(db):
+        db_gateway.assign_code_section_presentation_numbers(db, numbering)
 
 
-def split_document_sections_into_fragments(ctx):
-    db = db_gateway.get_database_connection(ctx)
+def split_document_sections_into_fragments(db: sqlite3.Connection):
+    # Collect every fragment, and then insert them all in one go.
+    fragments: List[Tuple[str, int, str, str, float]] = []
     sequence = 0.0
     for section_id, data in db_gateway.raw_document_sections_in_order(db):
         plain_text_start = 0
-        for match in patterns.CODE_BLOCK_REFERENCE_PATTERN.finditer(data):
+        # Only text containing "<<" can hold a reference, so don't bother running the regex over anything else.
+        references = patterns.CODE_BLOCK_REFERENCE_PATTERN.finditer(data) if "<<" in data else ()
+        for match in references:
             reference_name = match.group("just_the_referenced_name").strip()
-            if patterns.BAD_SECTION_NAME_PATTERN.search(reference_name):
+            if "<<" in reference_name or ">>" in reference_name:
                 raise errors.BadSectionNameError(
                     f'Section name (reference) "{reference_name}" must not contain "<<" or ">>".'
                 )
@@ -117,60 +153,70 @@ def split_document_sections_into_fragments(ctx):
             plain_text = data[plain_text_start : match.start("complete_reference")]
             plain_text_start = match.end("complete_reference")
             if plain_text:
-                db_gateway.insert_fragment(db, "plain text", section_id, plain_text, sequence=sequence)
+                fragments.append(("plain text", section_id, plain_text, "", sequence))
                 sequence += 1.0
-            db_gateway.insert_fragment(db, "reference", section_id, reference_name, indent, sequence=sequence)
+            fragments.append(("reference", section_id, reference_name, indent, sequence))
             sequence += 1.0
         if plain_text_start < len(data):
-            db_gateway.insert_fragment(db, "plain text", section_id, data[plain_text_start:], sequence=sequence)
+            fragments.append(("plain text", section_id, data[plain_text_start:], "", sequence))
             sequence += 1.0
+    with db_gateway.transaction(db):
+        db_gateway.insert_fragments(db, fragments)
 
 
-def resolve_all_abbreviations(ctx):
+def resolve_all_abbreviations(db: sqlite3.Connection):
     def fix_abbreviations(find_fn, fix_fn):
+        fixes = []
         for id_to_fix, name in find_fn(db):
             abbreviated_name = name[:-3]  # chop off the trailing '...'
-            full_names = set(db_gateway.resolve_abbreviation(db, abbreviated_name))
-            if (number_of_matches := len(full_names)) != 1:
-                message = "does not identify any code-section."
-                if number_of_matches > 1:
-                    message = f"matches multiple code-sections -- {full_names}."
-                raise errors.NonUniqueAbbreviationError(f'The abbreviation "{name}" ' + message)
-            fix_fn(db, id_to_fix, full_names.pop())
+            # Stop looking as soon as a second match shows the abbreviation isn't unique.
+            full_names = db_gateway.resolve_abbreviation(db, abbreviated_name)
+            if (full_name := next(full_names, None)) is None:
+                raise errors.NonUniqueAbbreviationError(
+                    f'The abbreviation "{name}" does not identify any code-section.'
+                )
+            if (another_full_name := next(full_names, None)) is not None:
+                all_full_names = {full_name, another_full_name, *full_names}
+                raise errors.NonUniqueAbbreviationError(
+                    f'The abbreviation "{name}" matches multiple code-sections -- {all_full_names}.'
+                )
+            fixes.append((full_name, id_to_fix))
+        with db_gateway.transaction(db):
+            fix_fn(db, fixes)
 
-    db = db_gateway.get_database_connection(ctx)
     db_gateway.collect_all_unabbreviated_names(db)
-    fix_abbreviations(db_gateway.abbreviated_code_section_names, db_gateway.assign_code_section_name)
-    fix_abbreviations(db_gateway.abbreviated_reference_fragment_names, db_gateway.assign_reference_fragment_name)
+    fix_abbreviations(db_gateway.abbreviated_code_section_names, db_gateway.assign_code_section_names)
+    fix_abbreviations(db_gateway.abbreviated_reference_fragment_names, db_gateway.assign_reference_fragment_names)
 
 
-def group_fragments_by_section_name(ctx):
-    db = db_gateway.get_database_connection(ctx)
-    for parent_name_id, name in db_gateway.unabbreviated_names(db):
-        db_gateway.assign_fragment_parent_name_ids(db, parent_name_id, name)
+def group_fragments_by_section_name(db: sqlite3.Connection):
+    names = [tuple(row) for row in db_gateway.unabbreviated_names(db)]
+    with db_gateway.transaction(db):
+        db_gateway.assign_fragment_parent_name_ids(db, names)
 
 
-def collect_non_root_names(ctx):
-    db = db_gateway.get_database_connection(ctx)
+def collect_non_root_names(db: sqlite3.Connection):
     db_gateway.collect_non_root_names(db)
 
 
-def assemble_fragments_into_plain_text(
+def _assemble_fragments_into_plain_text(
     db: sqlite3.Connection,
     name: str,
-    name_stack: Optional[List[str]] = None,
-    hunk_in_progress: str = "",
-    indent: str = "",
-) -> str:
-
-    # Manage the stack of open code-section names.
-    if name_stack is None:
-        name_stack = []
-    if name in name_stack:
+    name_stack: List[str],
+    open_names: Set[str],
+    hunk_in_progress: List[str],
+    needs_indent: bool,
+    indent: str,
+) -> bool:
+    # Appends to hunk_in_progress, which is joined only once by the caller; returns whether it currently ends a line.
+
+    # Manage the stack of open code-section names (and the set of them, for a quick membership test).
+    if name in open_names:
         raise errors.CodeSectionRecursionError(f'Code-section "{name}" recursively includes itself.')
     if not db_gateway.is_name_defined_by_code_section(db, name):
         raise errors.NoSuchCodeSectionError(f'Code-section "{name}" not found.')
     name_stack.append(name)
+    open_names.add(name)
 
     document_section_separator = ""
     current_parent_id = None
@@ -181,50 +227,94 @@ def assemble_fragments_into_plain_text(
         fragment_indent,
     ) in db_gateway.fragments_belonging_to_this_name_in_order(db, name):
         if parent_id != current_parent_id:
-            hunk_in_progress += document_section_separator
+            if document_section_separator:
+                hunk_in_progress.append(document_section_separator)
+                needs_indent = True
             document_section_separator = "\n"
             current_parent_id = parent_id
         if kind == "plain text":
-            needs_indent = hunk_in_progress.endswith("\n")
-            for line in fragment_data.splitlines(keepends=True):
+            if not indent:
+                # nothing to insert, so there is no need to walk the fragment line by line
+                hunk_in_progress.append(fragment_data)
+            elif patterns.LINE_BOUNDARY_OTHER_THAN_NEWLINE_PATTERN.search(fragment_data):
+                # splitlines finds line boundaries that str.replace won't, so walk those fragments line by line
+                for line in fragment_data.splitlines(keepends=True):
+                    if needs_indent:
+                        hunk_in_progress.append(indent)
+                    hunk_in_progress.append(line)
+                    needs_indent = True
+            else:
+                # indent every line but the first (which may continue a line already begun) in one pass
                 if needs_indent:
-                    hunk_in_progress += indent
-                hunk_in_progress += line
-                needs_indent = True
+                    hunk_in_progress.append(indent)
+                hunk_in_progress.append(fragment_data[:-1].replace("\n", "\n" + indent) + fragment_data[-1])
+            needs_indent = fragment_data.endswith("\n")
         elif kind == "reference":
-            hunk_in_progress = assemble_fragments_into_plain_text(
-                db, fragment_data, name_stack, hunk_in_progress, indent + fragment_indent
+            needs_indent = _assemble_fragments_into_plain_text(
+                db, fragment_data, name_stack, open_names, hunk_in_progress, needs_indent, indent + fragment_indent
             )
         # TODO: raise an error if kind is something else?
 
     # Manage the stack of open code-section names.
-    name_stack.pop()
-    return hunk_in_progress
+    open_names.remove(name_stack.pop())
+    return needs_indent
 
 
-def resolve_named_code_sections_into_plain_text(ctx):
-    db = db_gateway.get_database_connection(ctx)
-    found_any_roots = False
+def assemble_fragments_into_plain_text(
+    db: sqlite3.Connection,
+    name: str,
+    name_stack: Optional[List[str]] = None,
+    hunk_in_progress: str = "",
+    indent: str = "",
+) -> str:
+    if name_stack is None:
+        name_stack = []
+    pieces = [hunk_in_progress]
+    open_names = set(name_stack)
+    _assemble_fragments_into_plain_text(
+        db, name, name_stack, open_names, pieces, hunk_in_progress.endswith("\n"), indent
+    )
+    return "".join(pieces)
+
+
+def resolve_named_code_sections_into_plain_text(db: sqlite3.Connection, roots_to_extract: Optional[Set[str]] = None):
+    # Only the roots asked for (or all of them, when none are named) are worth the work of resolving.
+    resolved_code = []
+    any_roots = False
     for root_name_id, root_name in db_gateway.unabbreviated_names(db, roots_only=True):
-        # An output file should end with exactly one newline.
-        code = assemble_fragments_into_plain_text(db, root_name).rstrip("\r\n") + "\n"
-        db_gateway.insert_resolved_code(db, root_name_id, code)
-        found_any_roots = True
-    if not found_any_roots:
+        any_roots = True
+        if roots_to_extract is not None and root_name not in roots_to_extract:
+            continue
+        pieces: List[str] = []
+        _assemble_fragments_into_plain_text(db, root_name, [], set(), pieces, False, "")
+        resolved_code.append((root_name_id, common.join_into_output_file(pieces)))
+    if not any_roots:
         raise errors.NoRootCodeSectionsFoundError("No root code sections found.")
+    db_gateway.insert_resolved_code(db, resolved_code)
 
 
-def parse_source_file(ctx, db_path: str, root_source_file: Path):
-    db_gateway.create_database(ctx, db_path)
-    split_source_document_into_sections(ctx, root_source_file)
-    assign_presentation_numbers_to_code_sections(ctx)
-    split_document_sections_into_fragments(ctx)
-    resolve_all_abbreviations(ctx)
-    group_fragments_by_section_name(ctx)
-    collect_non_root_names(ctx)
-    resolve_named_code_sections_into_plain_text(ctx)
+def parse_source_file(
+    ctx, db_path: str, root_source_file: Union[str, os.PathLike], roots_to_extract: Optional[Set[str]] = None
+):
+    # Every phase works on the one connection made here, rather than fetching it from the context again.
+    db = db_gateway.create_database(ctx, db_path)
+    # One transaction for the whole parse, rather than one per statement.
+    with db_gateway.transaction(db):
+        split_source_document_into_sections(db, root_source_file)
+        assign_presentation_numbers_to_code_sections(db)
+        split_document_sections_into_fragments(db)
+        resolve_all_abbreviations(db)
+        group_fragments_by_section_name(db)
+        collect_non_root_names(db)
+        resolve_named_code_sections_into_plain_text(db, roots_to_extract)
 
 
 def get_code_files(ctx):
     db = db_gateway.get_database_connection(ctx)
     return dict(db_gateway.resolved_code(db))
+
+
+def get_code_file(ctx, name: str) -> Optional[str]:
+    # Just the one output file; None if there is no root by that name.
+    db = db_gateway.get_database_connection(ctx)
+    return db_gateway.resolved_code_for_name(db, name)
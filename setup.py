@@ -1,8 +1,9 @@
+from pathlib import Path
+
 from setuptools import setup, find_packages  # type: ignore
 
 
-with open("README.md", "r") as f:
-    readme = f.read()
+readme = Path("README.md").read_text(encoding="utf-8")
 
 
 setup(
@@ -10,6 +11,7 @@ setup(
     version="0.2.0",
     description="Literate Programming Tool",
     long_description=readme,
+    long_description_content_type="text/markdown",
     author="Wolf",
     author_email="Wolf@zv.cx",
     url="",
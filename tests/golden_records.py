@@ -0,0 +1,44 @@
+"""
+The test-data cases that both readers, blue.scanner and blue.bootstrap.original_scanner, are held to.  Each reader's
+tests add the cases only that reader supports.
+"""
+
+import functools
+from pathlib import Path
+
+from blue import errors
+
+
+# Golden records are only ever read, so each one need only be read from disk once per test session.
+@functools.lru_cache(maxsize=None)
+def read_golden_record(path: str):
+    return Path(path + ".golden-record").read_bytes().decode("utf-8")
+
+
+# Each of these source files has a single root, generated_output, which should match the named golden record.
+SINGLE_ROOT_CASES = {
+    "test-get-roots": "test-get-roots",
+    "test-same-named-sections-concatenate": "test-same-named-sections-concatenate",
+    "test-doc-is-ignored": "test-doc-is-ignored",
+    "test-sections-can-include-sections": "test-sections-can-include-sections",
+    "test-section-names-ignore-surrounding-whitespace": "test-section-names-ignore-surrounding-whitespace",
+    "test-inline-substitution": "test-inline-substitution",
+    "test-consecutive-section-includes": "test-consecutive-section-includes",
+    "test-indentation-is-preserved": "test-indentation-is-preserved",
+    "test-root-ends-with-the-right-number-of-newlines": "test-root-ends-with-the-right-number-of-newlines",
+    "test-last-character-preserved": "test-last-character-preserved",
+    "test-newlines-are-preserved-between-section-pieces": "test-newlines-are-preserved-between-section-pieces",
+    "test-include-files": "test-nested-include-files",
+    "test-nested-include-files": "test-nested-include-files",
+}
+
+# Each of these source files should fail with the given error.
+FAILING_CASES = {
+    "test-bad-section-names-fail": errors.BadSectionNameError,
+    "test-empty-section-name-fails": errors.BadSectionNameError,
+    "test-reference-with-bad-pattern-fails": errors.BadSectionNameError,
+    "test-section-name-not-found-fails": errors.NoSuchCodeSectionError,
+    "test-recursive-include-files-fail": errors.FileIncludeRecursionError,
+    "test-recursive-sections-fail": errors.CodeSectionRecursionError,
+    "test-no-roots-means-recursion": errors.NoRootCodeSectionsFoundError,
+}
@@ -0,0 +1,139 @@
+from click.testing import CliRunner
+import pytest
+
+from blue import blue, scanner
+
+
+class MockContext:
+    def __init__(self):
+        self.obj = dict()
+
+
+@pytest.fixture()
+def source_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    source_file = tmp_path / "source.w"
+    source_file.write_text('<<hello.py>>=\nprint("hello")\n')
+    return str(source_file)
+
+
+@pytest.fixture()
+def scans(monkeypatch):
+    scanned_files = []
+
+    def parse_source_file(ctx, db_path, root_source_file, roots_to_extract=None):
+        scanned_files.append(root_source_file)
+        original_parse_source_file(ctx, db_path, root_source_file, roots_to_extract)
+
+    original_parse_source_file = scanner.parse_source_file
+    monkeypatch.setattr(scanner, "parse_source_file", parse_source_file)
+    return scanned_files
+
+
+def test_cache_hit_skips_the_scanner(source_file, scans):
+    code_files = blue.read_code_files(MockContext(), source_file, None, ":memory:", True)
+    assert blue.read_code_files(MockContext(), source_file, None, ":memory:", True) == code_files
+    assert code_files == {"hello.py": 'print("hello")\n'}
+    assert len(scans) == 1
+
+
+def test_no_cache_always_scans(source_file, scans):
+    blue.read_code_files(MockContext(), source_file, None, ":memory:", True)
+    blue.read_code_files(MockContext(), source_file, None, ":memory:", False)
+    assert len(scans) == 2
+
+
+def test_extracting_some_roots_stores_nothing(source_file, scans):
+    blue.read_code_files(MockContext(), source_file, {"hello.py"}, ":memory:", True)
+    blue.read_code_files(MockContext(), source_file, None, ":memory:", True)
+    assert len(scans) == 2
+
+
+class ReversedExecutor:
+    """
+    Stands in for the process pool: runs the tasks in this process, last first, as if the first source took the
+    longest to scan; but, like the real executor's map, hands the results back in order.
+    """
+
+    used = False
+
+    def __init__(self, max_workers):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, fn, items):
+        ReversedExecutor.used = True
+        results = [fn(item) for item in reversed(list(items))]
+        return iter(results[::-1])
+
+
+@pytest.fixture()
+def sources_sharing_an_output(tmp_path, monkeypatch):
+    first_source = tmp_path / "first.w"
+    second_source = tmp_path / "second.w"
+    first_source.write_text("<<shared.out>>=\nfrom the first source\n")
+    second_source.write_text("<<shared.out>>=\nfrom the second source\n")
+    ReversedExecutor.used = False
+    monkeypatch.setattr(blue, "ProcessPoolExecutor", ReversedExecutor)
+    return str(first_source), str(second_source)
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_the_last_source_named_wins(tmp_path, sources_sharing_an_output, jobs):
+    output_directory = tmp_path / "output"
+    arguments = [
+        "tangle",
+        "--no-cache",
+        "--jobs",
+        jobs,
+        "--base-dir",
+        str(output_directory),
+        *sources_sharing_an_output,
+    ]
+    result = CliRunner().invoke(blue.blue, arguments, obj={})
+    assert result.exit_code == 0, result.output
+    assert ReversedExecutor.used == (jobs != "1")
+    assert (output_directory / "shared.out").read_text() == "from the second source\n"
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_errors_are_reported_in_command_line_order(tmp_path, jobs):
+    bad_sources = []
+    for name in ("b.w", "a.w"):
+        bad_sources.append(tmp_path / name)
+        bad_sources[-1].write_text("<<out>>=\n<<missing>>\n")
+    result = CliRunner().invoke(blue.blue, ["tangle", "--no-cache", "--jobs", jobs, *map(str, bad_sources)], obj={})
+    assert result.exit_code == 0, result.output
+    reported_paths = [line.split('"')[1] for line in result.output.splitlines()]
+    assert reported_paths == [str(path) for path in bad_sources]
+
+
+def test_errors_are_reported_even_when_a_write_fails(tmp_path, monkeypatch):
+    bad_source = tmp_path / "bad.w"
+    good_source = tmp_path / "good.w"
+    bad_source.write_text("<<out>>=\n<<missing>>\n")
+    good_source.write_text("<<out>>=\nfine\n")
+
+    def write_code_files(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(blue, "write_code_files", write_code_files)
+    result = CliRunner().invoke(
+        blue.blue, ["tangle", "--no-cache", "--jobs", "1", str(bad_source), str(good_source)], obj={}
+    )
+    assert isinstance(result.exception, OSError)
+    assert f'Error while processing "{bad_source}"' in result.output
+
+
+def test_tangle_only_caches_when_asked_to(tmp_path, source_file):
+    cache_directory = tmp_path / "cache" / "blue"
+    output_directory = str(tmp_path / "output")
+    CliRunner().invoke(blue.blue, ["tangle", "--base-dir", output_directory, source_file], obj={})
+    assert not cache_directory.exists()
+    CliRunner().invoke(blue.blue, ["tangle", "--cache", "--base-dir", output_directory, source_file], obj={})
+    assert len(list(cache_directory.iterdir())) == 1
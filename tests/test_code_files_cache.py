@@ -0,0 +1,36 @@
+from blue import code_files_cache
+
+
+def test_store_then_load_round_trips(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    code_files = {"hello.py": 'print("hello")\n'}
+    code_files_cache.store("some-key", code_files)
+    assert code_files_cache.load("some-key") == code_files
+
+
+def test_load_misses_cleanly(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    assert code_files_cache.load("no-such-key") is None
+
+
+def test_key_changes_when_an_included_file_changes(tmp_path):
+    source_file = tmp_path / "source.w"
+    included_file = tmp_path / "included.w"
+    source_file.write_text("<<hello.py>>=\n<<greeting>>\n@include(included.w)\n")
+    included_file.write_text('<<greeting>>=\nprint("hello")\n')
+    original_key = code_files_cache.cache_key(source_file)
+    assert code_files_cache.cache_key(source_file) == original_key
+    included_file.write_text('<<greeting>>=\nprint("goodbye")\n')
+    assert code_files_cache.cache_key(source_file) != original_key
+
+
+def test_unreadable_source_has_no_key(tmp_path):
+    assert code_files_cache.cache_key(tmp_path / "missing.w") is None
+
+
+def test_key_changes_when_blue_itself_changes(tmp_path, monkeypatch):
+    source_file = tmp_path / "source.w"
+    source_file.write_text('<<hello.py>>=\nprint("hello")\n')
+    original_key = code_files_cache.cache_key(source_file)
+    monkeypatch.setattr(code_files_cache, "_blue_source_digest", lambda: b"some other scanner")
+    assert code_files_cache.cache_key(source_file) != original_key
@@ -1,4 +1,7 @@
+import os
 from pathlib import Path
+import subprocess
+import sys
 
 import pytest
 
@@ -17,7 +20,7 @@ def any_output_files(output_root):
 
 def unlink_all_output_files(output_root):
     for f in output_root.glob("*"):
-        if f.is_file():
+        if f.is_symlink() or f.is_file():
             f.unlink()
         elif f.is_dir():
             unlink_all_output_files(f)
@@ -39,13 +42,13 @@ def shared_context():
 
 
 def test_writes_file(output_root, manage_output, shared_context):
-    code_files = get_code_files(shared_context, Path("tests/data/test-writes-file.w"))
+    code_files = get_code_files(shared_context, "tests/data/test-writes-file.w")
     write_code_files(shared_context, code_files)
     assert (output_root / "test-writes-file.out").exists()
 
 
 def test_writes_multiple_files(output_root, manage_output, shared_context):
-    code_files = get_code_files(shared_context, Path("tests/data/test-writes-multiple-files.w"))
+    code_files = get_code_files(shared_context, "tests/data/test-writes-multiple-files.w")
     write_code_files(shared_context, code_files)
     assert (output_root / "test-writes-multiple-files1.out").exists()
     assert (output_root / "test-writes-multiple-files2.out").exists()
@@ -53,7 +56,7 @@ def test_writes_multiple_files(output_root, manage_output, shared_context):
 
 
 def test_writes_select_files(output_root, manage_output, shared_context):
-    code_files = get_code_files(shared_context, Path("tests/data/test-writes-multiple-files.w"))
+    code_files = get_code_files(shared_context, "tests/data/test-writes-multiple-files.w")
     write_code_files(
         shared_context,
         code_files,
@@ -65,13 +68,72 @@ def test_writes_select_files(output_root, manage_output, shared_context):
 
 
 def test_creates_directories(output_root, manage_output, shared_context):
-    code_files = get_code_files(shared_context, Path("tests/data/test-creates-directories.w"))
+    code_files = get_code_files(shared_context, "tests/data/test-creates-directories.w")
     write_code_files(shared_context, code_files)
     assert (output_root / "deeper" / "test-creates-directories.out").exists()
 
 
 def test_respects_supplied_base_directory(output_root, manage_output, shared_context):
-    code_files = get_code_files(shared_context, Path("tests/data/test-respects-supplied-base-directory.w"))
+    code_files = get_code_files(shared_context, "tests/data/test-respects-supplied-base-directory.w")
     write_code_files(shared_context, code_files, base_directory=output_root)
     assert (output_root / "a.out").exists()
     assert (output_root / "b" / "c.out").exists()
+
+
+def test_unchanged_files_are_not_rewritten(output_root, manage_output, shared_context):
+    code_files = get_code_files(shared_context, "tests/data/test-writes-multiple-files.w")
+    write_code_files(shared_context, code_files)
+    unchanged_file = output_root / "test-writes-multiple-files1.out"
+    changed_file = output_root / "test-writes-multiple-files2.out"
+    os.utime(unchanged_file, ns=(0, 0))
+    changed_file.write_text("something else\n")
+    os.utime(changed_file, ns=(0, 0))
+    write_code_files(shared_context, code_files)
+    assert unchanged_file.stat().st_mtime_ns == 0
+    assert changed_file.stat().st_mtime_ns != 0
+    assert changed_file.read_text() == code_files["tests/output/test-writes-multiple-files2.out"]
+
+
+def test_writes_utf8_whatever_the_locale(output_root, manage_output):
+    # The default encoding is fixed at startup, so write from a fresh interpreter whose locale is plain ASCII.
+    environment = dict(os.environ, LC_ALL="C", PYTHONCOERCECLOCALE="0", PYTHONUTF8="0")
+    write = (
+        "from blue.code_writer import write_code_files; write_code_files({}, {'utf8.out': 'caf\\u00e9\\n'}, None, %r)"
+    )
+    subprocess.run([sys.executable, "-c", write % str(output_root)], env=environment, check=True)
+    assert (output_root / "utf8.out").read_bytes() == "caf\u00e9\n".encode("utf-8")
+
+
+def test_rewritten_files_keep_their_mode(output_root, manage_output, shared_context):
+    code_files = get_code_files(shared_context, "tests/data/test-writes-file.w")
+    write_code_files(shared_context, code_files)
+    output_file = output_root / "test-writes-file.out"
+    output_file.write_text("something else\n")
+    output_file.chmod(0o755)
+    write_code_files(shared_context, code_files)
+    assert output_file.read_text() == code_files["tests/output/test-writes-file.out"]
+    assert output_file.stat().st_mode & 0o777 == 0o755
+    assert [p.name for p in output_root.iterdir()] == ["test-writes-file.out"]
+
+
+def test_unchanged_files_are_not_rewritten_with_translated_newlines(
+    output_root, manage_output, shared_context, monkeypatch
+):
+    monkeypatch.setattr(os, "linesep", "\r\n")  # as on Windows
+    write_code_files(shared_context, {"crlf.out": "a\nb\n"}, base_directory=output_root)
+    output_file = output_root / "crlf.out"
+    assert output_file.read_bytes() == b"a\r\nb\r\n"
+    os.utime(output_file, ns=(0, 0))
+    write_code_files(shared_context, {"crlf.out": "a\nb\n"}, base_directory=output_root)
+    assert output_file.stat().st_mtime_ns == 0
+
+
+def test_symlinked_and_hard_linked_outputs_are_written_through(output_root, manage_output, shared_context):
+    (output_root / "real").mkdir()
+    (output_root / "symlink.out").symlink_to(Path("real") / "target.out")
+    (output_root / "real" / "hard-linked.out").write_text("old\n")
+    os.link(output_root / "real" / "hard-linked.out", output_root / "hard-link.out")
+    write_code_files(shared_context, {"symlink.out": "new\n", "hard-link.out": "new\n"}, base_directory=output_root)
+    assert (output_root / "symlink.out").is_symlink()
+    assert (output_root / "real" / "target.out").read_text() == "new\n"
+    assert (output_root / "real" / "hard-linked.out").read_text() == "new\n"
@@ -1,4 +1,6 @@
-from pathlib import Path
+import os
+
+import sqlite3
 
 import pytest
 
@@ -20,9 +22,25 @@ def db(shared_context):
 
 
 def test_can_get_just_root_names(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-code-section-sequence-numbers.w"))
+    scanner.parse_source_file(shared_context, ":memory:", "tests/data/test-code-section-sequence-numbers.w")
     db = db_gateway.get_database_connection(shared_context)
     all_names = dict(db_gateway.unabbreviated_names(db))
     root_names = dict(db_gateway.unabbreviated_names(db, roots_only=True))
     assert len(all_names) == 4
     assert len(root_names) == 1
+
+
+def test_transaction_reraises_errors_that_already_rolled_back(db):
+    db.execute("CREATE TEMP TRIGGER refuse BEFORE INSERT ON code_section_name BEGIN SELECT RAISE(ROLLBACK, 'no'); END")
+    with pytest.raises(sqlite3.IntegrityError):
+        with db_gateway.transaction(db):
+            db.execute("INSERT INTO code_section_name (name) VALUES ('a')")
+    assert not db.in_transaction
+
+
+def test_each_process_builds_its_own_template(monkeypatch):
+    monkeypatch.setattr(db_gateway, "_TEMPLATE_DATABASES", {})
+    template = db_gateway._template_database()
+    assert db_gateway._template_database() is template
+    monkeypatch.setattr(os, "getpid", lambda: -1)  # as in a forked child
+    assert db_gateway._template_database() is not template
@@ -1,181 +1,111 @@
-from pathlib import Path
+import os
 
 import pytest
 
 from blue import db_gateway, errors, scanner
+from golden_records import read_golden_record
+import golden_records
+
+
+class MockContext:
+    def __init__(self):
+        self.obj = dict()
 
 
 @pytest.fixture()
 def shared_context():
-    class MockContext:
-        def __init__(self):
-            self.obj = dict()
-
     return MockContext()
 
 
+@pytest.fixture(scope="module")
+def sequence_numbers_context():
+    # These tests only look at the result, so parse it once for all of them.
+    context = MockContext()
+    scanner.parse_source_file(context, ":memory:", "tests/data/test-code-section-sequence-numbers.w")
+    return context
+
+
 @pytest.fixture()
 def db(shared_context):
     return db_gateway.create_database(shared_context, ":memory:")
 
 
-def read_golden_record(path: str):
-    with open(path + ".golden-record", "r") as f:
-        golden_record = f.read()
-    return golden_record
-
-
 # TODO: test no code-sections found fails
 # TODO: test case insensitive code-section names match
 # TODO: test first unabbreviated version of a name is the canonical case, can't possibly work!!!
 
 
-def test_get_roots(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-get-roots.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-get-roots")
-
-
-def test_section_boundaries(shared_context):
-    golden_record = read_golden_record("tests/data/test-section-boundaries")
-
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-section-boundary-eof.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output_eof_test"] == golden_record
-
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-section-boundary-doc.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output_doc_test"] == golden_record
-
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-section-boundary-code.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output_code_test"] == golden_record
-
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-section-boundary-include.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output_code_test"] == golden_record
-
-
-def test_multiple_root_sections(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-multiple-root-sections.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output_A"] == read_golden_record("tests/data/test-multiple-root-sections-A")
-    assert code_files["generated_output_B"] == read_golden_record("tests/data/test-multiple-root-sections-B")
-    assert code_files["generated_output_C"] == read_golden_record("tests/data/test-multiple-root-sections-C")
-
-
-def test_same_named_sections_concatenate(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-same-named-sections-concatenate.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-same-named-sections-concatenate")
-
-
-def test_doc_is_ignored(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-doc-is-ignored.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-doc-is-ignored")
-
-
-def test_sections_can_include_sections(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-sections-can-include-sections.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-sections-can-include-sections")
-
-
-def test_section_names_ignore_surrounding_whitespace(shared_context):
-    scanner.parse_source_file(
-        shared_context, ":memory:", Path("tests/data/test-section-names-ignore-surrounding-whitespace.w")
-    )
-    code_files = scanner.get_code_files(shared_context)
-    golden_record = read_golden_record("tests/data/test-section-names-ignore-surrounding-whitespace")
-    assert code_files["generated_output"] == golden_record
-
-
-def test_inline_substitution(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-inline-substitution.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-inline-substitution")
-
-
-def test_consecutive_section_includes(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-consecutive-section-includes.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-consecutive-section-includes")
-
-
-def test_inner_whitespace_is_not_indent(shared_context):
-    scanner.parse_source_file(
-        shared_context, ":memory:", Path("tests/data/test-inner-whitespace-is-not-indent.w")
-    )
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record(
-        "tests/data/test-inner-whitespace-is-not-indent"
-    )
+# The cases both readers share, plus those only this one handles.
+SINGLE_ROOT_CASES = {
+    **golden_records.SINGLE_ROOT_CASES,
+    "test-inner-whitespace-is-not-indent": "test-inner-whitespace-is-not-indent",
+    "test-consecutive-section-includes-dont-drop-indent": "test-consecutive-section-includes-dont-drop-indent",
+    "test-included-section-name-is-abbreviated": "test-included-section-name-is-abbreviated",
+    "test-section-definition-is-abbreviated-but-included-section-is-not": "test-included-section-name-is-abbreviated",
+}
 
 
-def test_consecutive_section_includes_dont_drop_indent(shared_context):
-    scanner.parse_source_file(
-        shared_context, ":memory:", Path("tests/data/test-consecutive-section-includes-dont-drop-indent.w")
-    )
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record(
-        "tests/data/test-consecutive-section-includes-dont-drop-indent"
-    )
+@pytest.mark.parametrize("source_name", SINGLE_ROOT_CASES)
+def test_single_root(shared_context, source_name):
+    scanner.parse_source_file(shared_context, ":memory:", f"tests/data/{source_name}.w")
+    golden_record = read_golden_record(f"tests/data/{SINGLE_ROOT_CASES[source_name]}")
+    assert scanner.get_code_file(shared_context, "generated_output") == golden_record
 
 
-def test_indentation_is_preserved(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-indentation-is-preserved.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-indentation-is-preserved")
+# The cases both readers share, plus those only this one handles.
+FAILING_CASES = {
+    **golden_records.FAILING_CASES,
+    "test-non-unique-abbreviation-fails": errors.NonUniqueAbbreviationError,
+    "test-no-code-sections-at-all-fails": errors.NoRootCodeSectionsFoundError,
+}
 
 
-def test_newlines_are_trimmed_at_eof(shared_context):
-    scanner.parse_source_file(
-        shared_context, ":memory:", Path("tests/data/test-root-ends-with-the-right-number-of-newlines.w")
-    )
-    code_files = scanner.get_code_files(shared_context)
-    golden_record = read_golden_record("tests/data/test-root-ends-with-the-right-number-of-newlines")
-    assert code_files["generated_output"] == golden_record
+@pytest.mark.errors
+@pytest.mark.parametrize("source_name", FAILING_CASES)
+def test_failure(shared_context, source_name):
+    with pytest.raises(FAILING_CASES[source_name]):
+        scanner.parse_source_file(shared_context, ":memory:", f"tests/data/{source_name}.w")
 
 
-def test_last_character_preserved_when_file_does_not_end_with_newline(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-last-character-preserved.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-last-character-preserved")
+def test_section_boundaries(shared_context):
+    golden_record = read_golden_record("tests/data/test-section-boundaries")
 
+    scanner.parse_source_file(shared_context, ":memory:", "tests/data/test-section-boundary-eof.w")
+    assert scanner.get_code_file(shared_context, "generated_output_eof_test") == golden_record
 
-def test_newlines_are_preserved_between_section_pieces(shared_context):
-    scanner.parse_source_file(
-        shared_context, ":memory:", Path("tests/data/test-newlines-are-preserved-between-section-pieces.w")
-    )
-    code_files = scanner.get_code_files(shared_context)
-    golden_record = read_golden_record("tests/data/test-newlines-are-preserved-between-section-pieces")
-    assert code_files["generated_output"] == golden_record
+    scanner.parse_source_file(shared_context, ":memory:", "tests/data/test-section-boundary-doc.w")
+    assert scanner.get_code_file(shared_context, "generated_output_doc_test") == golden_record
 
+    scanner.parse_source_file(shared_context, ":memory:", "tests/data/test-section-boundary-code.w")
+    assert scanner.get_code_file(shared_context, "generated_output_code_test") == golden_record
 
-def test_include_files(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-include-files.w"))
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-nested-include-files")
+    scanner.parse_source_file(shared_context, ":memory:", "tests/data/test-section-boundary-include.w")
+    assert scanner.get_code_file(shared_context, "generated_output_code_test") == golden_record
 
 
-def test_nested_include_files(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-nested-include-files.w"))
+def test_multiple_root_sections(shared_context):
+    scanner.parse_source_file(shared_context, ":memory:", "tests/data/test-multiple-root-sections.w")
     code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-nested-include-files")
+    assert scanner.get_code_file(shared_context, "not_a_root") is None
+    assert scanner.get_code_file(shared_context, "GENERATED_OUTPUT_A") is None
+    assert code_files["generated_output_A"] == read_golden_record("tests/data/test-multiple-root-sections-A")
+    assert code_files["generated_output_B"] == read_golden_record("tests/data/test-multiple-root-sections-B")
+    assert code_files["generated_output_C"] == read_golden_record("tests/data/test-multiple-root-sections-C")
 
 
-def test_included_section_name_is_abbreviated(shared_context):
+def test_only_roots_to_extract_are_resolved(shared_context):
     scanner.parse_source_file(
-        shared_context, ":memory:", Path("tests/data/test-included-section-name-is-abbreviated.w")
+        shared_context,
+        ":memory:",
+        "tests/data/test-multiple-root-sections.w",
+        {"generated_output_B", "not_a_root"},
     )
     code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-included-section-name-is-abbreviated")
+    assert code_files == {"generated_output_B": read_golden_record("tests/data/test-multiple-root-sections-B")}
 
 
-def test_only_code_sections_are_assigned_presentation_numbers(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-code-section-sequence-numbers.w"))
-    db = db_gateway.get_database_connection(shared_context)
+def test_only_code_sections_are_assigned_presentation_numbers(sequence_numbers_context):
+    db = db_gateway.get_database_connection(sequence_numbers_context)
     count_document_sections_with_presentation_numbers = """
         SELECT count(*) AS count
         FROM document_section
@@ -188,9 +118,8 @@ def test_only_code_sections_are_assigned_presentation_numbers(shared_context):
         assert section_reader.fetchone()["count"] == 0
 
 
-def test_all_code_sections_are_assigned_presentation_numbers(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-code-section-sequence-numbers.w"))
-    db = db_gateway.get_database_connection(shared_context)
+def test_all_code_sections_are_assigned_presentation_numbers(sequence_numbers_context):
+    db = db_gateway.get_database_connection(sequence_numbers_context)
     count_code_sections_without_presentation_numbers = """
         SELECT count(*) AS count
         FROM document_section
@@ -203,79 +132,53 @@ def test_all_code_sections_are_assigned_presentation_numbers(shared_context):
         assert section_reader.fetchone()["count"] == 0
 
 
-def test_presentation_numbers_are_in_order(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-code-section-sequence-numbers.w"))
-    db = db_gateway.get_database_connection(shared_context)
-    find_code_sections = """
-        SELECT document_section.id, code_section_presentation_number
-        FROM document_section
-        JOIN document_section_kind ON document_section_kind.id = document_section.kind_id
-        WHERE document_section_kind.description = 'code'
-        ORDER BY document_section.id
+def test_presentation_numbers_are_in_order(sequence_numbers_context):
+    db = db_gateway.get_database_connection(sequence_numbers_context)
+    count_code_sections_out_of_order = """
+        SELECT count(*) AS count
+        FROM (
+            SELECT
+                code_section_presentation_number,
+                row_number() OVER (ORDER BY document_section.id) AS required_presentation_number
+            FROM document_section
+            JOIN document_section_kind ON document_section_kind.id = document_section.kind_id
+            WHERE document_section_kind.description = 'code'
+        )
+        WHERE code_section_presentation_number IS NOT required_presentation_number
     """
     with db_gateway.open_cursor(db) as code_section_reader:
-        code_section_reader.execute(find_code_sections)
-        for required_presentation_number, row in enumerate(code_section_reader.fetchall(), 1):
-            assert row["code_section_presentation_number"] == required_presentation_number
+        code_section_reader.execute(count_code_sections_out_of_order)
+        assert code_section_reader.fetchone()["count"] == 0
 
 
-def test_only_roots_are_finally_resolved(shared_context):
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-code-section-sequence-numbers.w"))
-    code_files = scanner.get_code_files(shared_context)
+def test_only_roots_are_finally_resolved(sequence_numbers_context):
+    code_files = scanner.get_code_files(sequence_numbers_context)
     assert len(code_files) == 1
 
 
-def test_section_definition_is_abbreviated_but_included_section_is_not(shared_context):
-    scanner.parse_source_file(
-        shared_context,
-        ":memory:",
-        Path("tests/data/test-section-definition-is-abbreviated-but-included-section-is-not.w"),
-    )
-    code_files = scanner.get_code_files(shared_context)
-    assert code_files["generated_output"] == read_golden_record("tests/data/test-included-section-name-is-abbreviated")
-
-
 def test_empty_definition_is_ok(shared_context):
     # should not raise errors.NoSuchCodeSectionError
-    scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-empty-definition-is-ok.w"))
-
-
-def test_non_unique_abbreviation_fails(shared_context):
-    with pytest.raises(errors.NonUniqueAbbreviationError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-non-unique-abbreviation-fails.w"))
-
-
-def test_bad_section_names_fail(shared_context):
-    with pytest.raises(errors.BadSectionNameError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-bad-section-names-fail.w"))
-    with pytest.raises(errors.BadSectionNameError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-empty-section-name-fails.w"))
-
-
-def test_bad_reference_names_fail(shared_context):
-    with pytest.raises(errors.BadSectionNameError):
-        scanner.parse_source_file(
-            shared_context, ":memory:", Path("tests/data/test-reference-with-bad-pattern-fails.w")
-        )
-
-
-def test_section_name_not_found_fails(shared_context):
-    with pytest.raises(errors.NoSuchCodeSectionError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-section-name-not-found-fails.w"))
-
-
-def test_recursive_include_files_fail(shared_context):
-    with pytest.raises(errors.FileIncludeRecursionError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-recursive-include-files-fail.w"))
-
-
-def test_recursive_sections_fail(shared_context):
-    with pytest.raises(errors.CodeSectionRecursionError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-recursive-sections-fail.w"))
-    with pytest.raises(errors.NoRootCodeSectionsFoundError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-no-roots-means-recursion.w"))
-
-
-def test_no_code_sections_at_all_fails(shared_context):
-    with pytest.raises(errors.NoRootCodeSectionsFoundError):
-        scanner.parse_source_file(shared_context, ":memory:", Path("tests/data/test-no-code-sections-at-all-fails.w"))
+    scanner.parse_source_file(shared_context, ":memory:", "tests/data/test-empty-definition-is-ok.w")
+
+
+def test_edited_include_file_is_read_again(shared_context, tmp_path):
+    source_file = tmp_path / "source.w"
+    included_file = tmp_path / "included.w"
+    source_file.write_text("<<hello.py>>=\n<<greeting>>\n@include(included.w)\n")
+    included_file.write_text('<<greeting>>=\nprint("hello")\n')
+    scanner.parse_source_file(shared_context, ":memory:", source_file)
+    assert scanner.get_code_file(shared_context, "hello.py") == 'print("hello")\n'
+
+    included_file.write_text('<<greeting>>=\nprint("goodbye")\n')
+    scanner.parse_source_file(shared_context, ":memory:", source_file)
+    assert scanner.get_code_file(shared_context, "hello.py") == 'print("goodbye")\n'
+    assert sum(path == os.path.realpath(included_file) for path in scanner._SCANNED_FILES) == 1
+
+
+def test_only_the_most_recently_scanned_files_are_kept(shared_context, tmp_path, monkeypatch):
+    monkeypatch.setattr(scanner, "_SCANNED_FILES_LIMIT", 2)
+    for name in ("a", "b", "c"):
+        source_file = tmp_path / f"{name}.w"
+        source_file.write_text(f"<<{name}.py>>=\n{name}\n")
+        scanner.parse_source_file(shared_context, ":memory:", source_file)
+    assert list(scanner._SCANNED_FILES) == [os.path.realpath(tmp_path / f"{name}.w") for name in ("b", "c")]